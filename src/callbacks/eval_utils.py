@@ -73,7 +73,8 @@ def make_preds_base_model(
         if hf:
             return tokenizer.encode(s)
         else:
-            return [lm.encoder_sos] + tokenizer(s)
+            # tokenizer(s) is an np.ndarray; list-style + would broadcast-add.
+            return np.concatenate(([lm.encoder_sos], tokenizer(s)))
     
     def generate_mask(max_len, in_lens):
         return torch.arange(max_len).expand(len(in_lens), max_len).to(in_lens.device) < in_lens.unsqueeze(1)
@@ -1,62 +1,111 @@
 import numpy as np
 import torch
-from operator import mul
-from functools import reduce
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import warnings
-import pdb
+
+# torch.from_numpy warns when the source array is read-only (e.g. mmapped from
+# a file). It does not matter, since all batches are merged anyway, which
+# copies the data — filter once here instead of entering catch_warnings per
+# batch.
+warnings.filterwarnings("ignore", message=".*non-writable.*", category=UserWarning)
 
 class VarLengthCollate:
-    def __init__(self, tokenizer, ignore_symbol=0, batch_dim: int = 1):
+    def __init__(self, tokenizer, ignore_symbol=0, batch_dim: int = 1,
+                 max_shape: Optional[List[int]] = None):
         self.tokenizer = tokenizer
         self.ignore_symbol = ignore_symbol
         self.batch_dim = batch_dim
+        # When the maximum padded output shape (batch dim included) is known,
+        # one pinned buffer per dtype is allocated at that size and every batch
+        # is written into a sliced view of it instead of fresh storage.
+        self.max_shape = tuple(max_shape) if max_shape is not None else None
+        self._buffers: Dict[torch.dtype, torch.Tensor] = {}
+
+    @staticmethod
+    def _pack_array(b):
+        # np.asarray packs Python floats as float64; cast back to float32 to
+        # keep the dtype torch.tensor(list) used to produce.
+        arr = np.asarray(b)
+        if arr.dtype == np.float64:
+            arr = arr.astype(np.float32)
+        return arr
 
     @staticmethod
     def _measure_array_max_dim(batch: List[torch.Tensor]):
-        s=list(batch[0].size())
-        different=[False] * len(s)
-        for i in range(1, len(batch)):
-            ns = batch[i].size()
-            different = [different[j] or s[j]!=ns[j] for j in range(len(s))]
-            s=[max(s[j], ns[j]) for j in range(len(s))]
-        return s, different
+        ndim = batch[0].ndim
+        sizes = np.fromiter((dim for b in batch for dim in b.size()), dtype=np.int64,
+                            count=len(batch) * ndim).reshape(len(batch), ndim)
+        return sizes.max(0).tolist(), (sizes.max(0) != sizes.min(0)).tolist()
 
     def _merge_var_len_array(self, batch: List[torch.Tensor]):
         max_size, different = self._measure_array_max_dim(batch)
+        if not any(different):
+            # Uniform shapes: no padding needed, a single stack does the whole copy.
+            return torch.stack(batch, dim=self.batch_dim if batch[0].ndim >= self.batch_dim else 0)
         s=max_size[:self.batch_dim] + [len(batch)] + max_size[self.batch_dim:]
-        storage = batch[0].storage()._new_shared(reduce(mul, s, 1))
-        out = batch[0].new(storage).view(s).fill_(self.ignore_symbol if self.ignore_symbol is not None else 0)
+        fill = self.ignore_symbol if self.ignore_symbol is not None else 0
+        out = None
+        if self.max_shape is not None and len(s) == len(self.max_shape) \
+                and all(a <= b for a, b in zip(s, self.max_shape)):
+            dtype = batch[0].dtype
+            buf = self._buffers.get(dtype)
+            if buf is None:
+                buf = self._buffers[dtype] = torch.full(
+                    self.max_shape, fill, dtype=dtype, pin_memory=torch.cuda.is_available())
+            out = buf[tuple(slice(0, dim) for dim in s)]
+            out.fill_(fill)
+        if out is None:
+            # Pinned memory allows async H2D copies downstream.
+            out = torch.full(s, fill, dtype=batch[0].dtype, pin_memory=torch.cuda.is_available())
+        bdim = self.batch_dim if out.ndim > self.batch_dim else 0
+        diff_dims = [j for j, x in enumerate(different) if x]
+        template = [slice(None)] * out.ndim
         for i, d in enumerate(batch):
-            bdim = self.batch_dim if len(out.shape)>self.batch_dim else 0
-            this_o = out.narrow(bdim, i,  1).squeeze(bdim)
-            for j, diff in enumerate(different):
-                if different[j]:
-                    this_o = this_o.narrow(j, 0, d.size(j))
-
-            this_o.copy_(d)
+            idx = template.copy()
+            idx[bdim] = i
+            for j in diff_dims:
+                idx[j + (j >= bdim)] = slice(0, d.size(j))
+            out[tuple(idx)].copy_(d, non_blocking=True)
         return out
 
     def __call__(self, batch):
-        # print(type(batch[0]))
-        if isinstance(batch[0], dict):
-            return {k: self([b[k] for b in batch]) for k in batch[0].keys()}
-        elif isinstance(batch[0], np.ndarray):
-            with warnings.catch_warnings():
-                # If the source data is mmapped from a file, from_numpy will throw a warning that it is readonly.
-                # However it does not matter, since all batches will be merged anyway, which copies the data.
-                warnings.filterwarnings("ignore", category=UserWarning)
-                return self([torch.from_numpy(a) for a in batch])
-        elif torch.is_tensor(batch[0]):
+        first = batch[0]
+        if isinstance(first, dict):
+            # Single pass over the batch instead of one list-comp per key.
+            keys = list(first)
+            cols = [[] for _ in keys]
+            for b in batch:
+                for j, k in enumerate(keys):
+                    cols[j].append(b[k])
+            return {k: self(cols[j]) for j, k in enumerate(keys)}
+        elif isinstance(first, np.ndarray):
+            return self([torch.from_numpy(a) for a in batch])
+        elif torch.is_tensor(first):
             return self._merge_var_len_array(batch)
-        elif isinstance(batch[0], list):
-            if isinstance(batch[0][0], str):
+        elif isinstance(first, list):
+            if isinstance(first[0], str):
+                if self.tokenizer is not None and hasattr(self.tokenizer, "sentences_to_indices"):
+                    # Encode the whole batch in one pass instead of per-sentence calls.
+                    return self([torch.from_numpy(a) for a in self.tokenizer.sentences_to_indices(batch)])
                 return [b for b in batch]
             else:
-                return self([torch.tensor(b) for b in batch])
-        elif isinstance(batch[0], (int, float)):
-            return torch.Tensor(batch)
-        elif isinstance(batch[0], str):
+                # One C-level pack beats a torch.tensor(list) per element.
+                try:
+                    arr = self._pack_array(batch)
+                except ValueError:
+                    arr = None
+                if arr is None or arr.dtype == object:
+                    # Ragged lists: pack each element separately.
+                    return self([torch.from_numpy(self._pack_array(b)) for b in batch])
+                return self._merge_var_len_array(list(torch.from_numpy(arr)))
+        elif isinstance(first, (int, float)):
+            # np.asarray packs the scalars in C; torch.Tensor(list) infers
+            # element-by-element. Keep floats at the former float32 dtype.
+            arr = np.asarray(batch)
+            if arr.dtype == np.float64:
+                arr = arr.astype(np.float32)
+            return torch.as_tensor(arr)
+        elif isinstance(first, str):
             return batch
         else:
-            assert False, "Unknown type: %s" % type(batch[0])
+            assert False, "Unknown type: %s" % type(first)
@@ -1,7 +1,13 @@
+import functools
 import re
-from typing import List, Union, Optional, Dict, Any, Set
+import sys
+import numpy as np
+from typing import List, Union, Optional, Dict, Any, Set, Tuple
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+# Compiled once; split_sentence runs per sample in data-loader workers.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
 
 class WordVocabulary:
     def __init__(
@@ -12,6 +18,8 @@ class WordVocabulary:
     ):
         self.words: Dict[str, int] = {}
         self.inv_words: Dict[int, str] = {}
+        # IDs are dense 0..N, so keep a parallel list for O(1) index lookups.
+        self._inv_list: List[str] = []
         # always map <pad> to 0!
         self._add_word("<pad>")
         self.to_save = [
@@ -37,12 +45,16 @@ class WordVocabulary:
         if self.allow_any_word:
             assert self._unk_index is not None
 
+        self._sentence_to_indices_cached.cache_clear()
         self.initialized = True
 
     def _add_word(self, w: str):
+        # Interned keys turn later dict probes into pointer-identity hits.
+        w = sys.intern(w)
         next_id = len(self.words)
         self.words[w] = next_id
         self.inv_words[next_id] = w
+        self._inv_list.append(w)
 
     def _add_set(self, words: Set[str]):
         for w in sorted(words):
@@ -56,10 +68,9 @@ class WordVocabulary:
         return res
 
     def _process_index(self, i: int) -> str:
-        res = self.inv_words.get(i, None)
-        if res is None:
-            return f"<!INV: {i}!>"
-        return res
+        if 0 <= i < len(self._inv_list):
+            return self._inv_list[i]
+        return f"<!INV: {i}!>"
 
     def __getitem__(self, item: Union[int, str]) -> Union[str, int]:
         if isinstance(item, int):
@@ -73,20 +84,57 @@ class WordVocabulary:
             return sentence
 
         if self.split_punctuation:
-            return re.findall(r"\w+|[^\w\s]", sentence, re.UNICODE)
+            return [sys.intern(t) for t in _TOKEN_RE.findall(sentence)]
         else:
-            return [x for x in sentence.split(" ") if x]
+            return [sys.intern(t) for t in sentence.split(" ") if t]
+
+    @functools.lru_cache(maxsize=1 << 16)
+    def _sentence_to_indices_cached(self, sentence: str) -> Tuple[int, ...]:
+        words = self.split_sentence(sentence)
+        # Bind the lookup locals once; three attribute loads per token add up.
+        get = self.words.get
+        unk = -1 if self._unk_index is None else self._unk_index
+        res = tuple(get(w, unk) for w in words)
+        if __debug__ and not self.allow_any_word and unk in res:
+            assert False, f"WARNING: unknown word: '{words[res.index(unk)]}'"
+        return res
 
-    def sentence_to_indices(self, sentence: Union[str, List[str]]) -> List[int]:
+    def sentence_to_indices(self, sentence: Union[str, List[str]]) -> np.ndarray:
         assert self.initialized
+        if isinstance(sentence, str):
+            # Repeated sentences (prompts, templates) skip the split + lookup.
+            return np.asarray(self._sentence_to_indices_cached(sentence), dtype=np.int64)
         words = self.split_sentence(sentence)
-        return [self._process_word(w) for w in words]
+        get = self.words.get
+        unk = -1 if self._unk_index is None else self._unk_index
+        arr = np.fromiter((get(w, unk) for w in words), dtype=np.int64, count=len(words))
+        if __debug__ and not self.allow_any_word and (arr == unk).any():
+            assert False, f"WARNING: unknown word: '{words[int(np.argmax(arr == unk))]}'"
+        return arr
+
+    def sentences_to_indices(self, sentences: List[Union[str, List[str]]]) -> List[np.ndarray]:
+        """Encode a batch of sentences at once.
+
+        Splits everything first, maps all tokens in one np.fromiter pass and
+        slices the result back per sentence, so the per-token loop stays in C.
+        """
+        assert self.initialized
+        split_lists = [self.split_sentence(s) for s in sentences]
+        offsets = np.cumsum([0] + [len(w) for w in split_lists])
+        flat = [w for words in split_lists for w in words]
+        get = self.words.get
+        unk = -1 if self._unk_index is None else self._unk_index
+        arr = np.fromiter((get(w, unk) for w in flat), dtype=np.int64, count=len(flat))
+        if not self.allow_any_word:
+            assert (arr != unk).all(), \
+                f"WARNING: unknown word: '{flat[int(np.argmax(arr == unk))]}'"
+        return [arr[offsets[i]:offsets[i + 1]] for i in range(len(sentences))]
 
     def indices_to_sentence(self, indices: List[int]) -> List[str]:
         assert self.initialized
         return [self._process_index(i) for i in indices]
 
-    def __call__(self, seq: Union[List[Union[str, int]], str]) -> List[Union[int, str]]:
+    def __call__(self, seq: Union[List[Union[str, int]], str]) -> Union[np.ndarray, List[str]]:
         if seq is None or (isinstance(seq, list) and not seq):
             return seq
 
@@ -104,13 +152,29 @@ class WordVocabulary:
     def load_state_dict(self, state: Dict[str, Any]):
         self.initialized = True
         self.__dict__.update(state)
+        # inv_words stays the serialized form; rebuild the dense list from it.
+        self._inv_list = [self.inv_words[i] for i in range(len(self.inv_words))]
+        self._sentence_to_indices_cached.cache_clear()
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        if "_inv_list" not in state:
+            # Vocabularies pickled before _inv_list existed.
+            self._inv_list = [state["inv_words"][i] for i in range(len(state["inv_words"]))]
 
     def __add__(self, other):
         res = WordVocabulary(
             allow_any_word=self.allow_any_word and other.allow_any_word,
             split_punctuation=self.split_punctuation,
         )
-        res._add_set(set(self.words.keys()) | set(other.words.keys()))
+        # <pad> is already at 0 in res; keep self's order, then append what
+        # only other has. O(N), no transient union set or sort.
+        for w in self.words:
+            if w not in res.words:
+                res._add_word(w)
+        for w in other.words:
+            if w not in res.words:
+                res._add_word(w)
         res.finalize()
         return res
 
@@ -127,6 +191,8 @@ class CharVocabulary:
         self.initialized = False
         self.ignore_char = ignore_char
         self.ignore_char_idx = ignore_char_idx
+        self._trans = None
+        self._from_bytes = None
         if chars is not None:
             self.from_set(chars)
 
@@ -141,6 +207,24 @@ class CharVocabulary:
         self.to_index = {c: i for i, c in enumerate(chars)}
         self.from_index = {i: c for i, c in enumerate(chars)}
 
+        if self.ignore_char is not None and all(isinstance(c, str) and len(c) == 1 for c in chars):
+            # Codepoint -> index table so str_to_ind can run as one NumPy gather.
+            # Unknown chars map to the ignore index; without an ignore char there
+            # is no safe default, so keep the raising dict path instead.
+            self._trans = np.full(0x110000, self.ignore_char_idx, dtype=np.int32)
+            self._trans[[ord(c) for c in chars]] = np.arange(len(chars), dtype=np.int32)
+        else:
+            self._trans = None
+
+        # Index -> byte table (padded to 256 for bytes.translate) so ind_to_str
+        # can decode a whole sequence in one C call.
+        if len(chars) <= 256 and all(isinstance(c, str) and len(c) == 1 and ord(c) < 256 for c in chars):
+            self._from_bytes = bytes(ord(c) for c in chars) + bytes(256 - len(chars))
+        elif len(chars) <= 256 and all(isinstance(c, int) and 0 <= c < 256 for c in chars):
+            self._from_bytes = bytes(chars) + bytes(256 - len(chars))
+        else:
+            self._from_bytes = None
+
         self.initialized = True
 
     def __len__(self):
@@ -153,9 +237,16 @@ class CharVocabulary:
         self.from_set(state["chars"])
 
     def str_to_ind(self, data: str) -> List[int]:
+        if isinstance(data, str) and getattr(self, "_trans", None) is not None:
+            codes = np.frombuffer(data.encode("utf-32-le"), dtype=np.uint32)
+            return self._trans[codes].tolist()
         return [self.to_index[c] for c in data]
 
     def ind_to_str(self, data: List[int]) -> str:
+        if getattr(self, "_from_bytes", None) is not None:
+            # bytes(ndarray) would serialize the raw int64 buffer, not the values.
+            raw = np.asarray(data, dtype=np.uint8).tobytes() if isinstance(data, np.ndarray) else bytes(data)
+            return raw.translate(self._from_bytes).decode("latin1")
         return "".join([self.from_index[i] for i in data])
 
     def _is_string(self, i):
@@ -179,6 +270,9 @@ class CharVocabulary:
 
 class ByteVocabulary(CharVocabulary):
     def ind_to_str(self, data: List[int]) -> bytearray:
+        if getattr(self, "_from_bytes", None) is not None:
+            raw = np.asarray(data, dtype=np.uint8).tobytes() if isinstance(data, np.ndarray) else bytes(data)
+            return bytearray(raw.translate(self._from_bytes))
         return bytearray([self.from_index[i] for i in data])
 
     def _is_string(self, i):